@@ -1,38 +1,77 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+import numpy as np
+import orjson
 import streamlit as st
-import requests
 from datetime import datetime, timedelta
-import time # Needed for the exponential backoff retry
+from llm import LLMError, get_backend
 
 # Configuration
-API_URL = "https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent"
-MAX_RETRIES = 5
+MAX_DAYS = 14
+MAX_OUTPUT_TOKENS = 3000
+BASE_OUTPUT_TOKENS = 300 # Headings and the Pro Tips section
+TOKENS_PER_DAY = 220 # Observed length of one filled-in Day section
+RESPONSE_TTL = 24 * 60 * 60 # Seconds a generated itinerary stays in the response cache
+RESPONSE_CACHE_SIZE = 256 # Max itineraries kept in memory; the disk cache holds the rest
+DISK_CACHE_DIR = Path(__file__).parent / ".cache" / "itineraries"
+DISK_CACHE_SIZE = 2 << 30 # 2 GiB, oldest entries are evicted beyond this
+DISK_CACHE_TTL = 7 * 24 * 60 * 60 # Seconds a generated itinerary stays in the disk cache
+CANNED_PATH = Path(__file__).parent / "assets" / "canned.json"
+SEMANTIC_THRESHOLD = 0.95 # Cosine similarity above which a previous itinerary is reused
+SEMANTIC_CACHE_SIZE = 32 # Itineraries per session compared on each lookup
+
+# --- Prompt Templates (built once at import, only the inputs are substituted per call) ---
+_DAY_TMPL = """
+### Day {i}
+-   **Morning:** [Fill in low-cost/free activity]
+-   **Afternoon:** [Fill in cultural/interest activity]
+-   **Evening:** [Fill in cheap food market/local hangout]
+-   **Transport Tip:** [Fill in public transport advice]
+-   **Estimated Daily Cost:** [Fill in rough daily budget]
+"""
+
+# Pre-formatted Day structure for every allowed trip length, indexed by days
+_DAY_STRUCTURES = [
+    "".join(_DAY_TMPL.format(i=i) for i in range(1, d + 1)) for d in range(MAX_DAYS + 1)
+]
+
+_PROMPT_TMPL = """
+You are an expert travel planner creating a detailed, budget-friendly itinerary for students.
+
+Destination: {destination}
+Days: {days}
+Interests: {interests}
+Budget: ${budget} (Total estimated cost)
+Travel Dates: {start_date} to {end_date}
+
+Generate the **{days}-day itinerary** below, strictly filling in the content for each of the pre-defined Day sections.
+
+{structure}
+
+Conclude the itinerary with a final section titled '💰 Money-Saving Pro Tips' listing 3 actionable, specific budget tips for this destination. Format the entire response using Markdown for clear readability.
+"""
 
 st.set_page_config(layout="centered")
 st.title("🎓 AI Student Travel Planner")
 st.markdown("---")
 
-# Load Gemini API key
-gemini_key = st.secrets.get("GEMINI_API_KEY")
-if not gemini_key:
-    st.error("🚨 Gemini API key not found in `secrets.toml`. Please configure your key to run the app.")
+# Load the Gemini backend (SDK with GOOGLE_API_KEY, REST with GEMINI_API_KEY)
+backend = get_backend(st.secrets)
+if backend is None:
+    st.error("🚨 Gemini API key not found in `secrets.toml`. Please configure `GEMINI_API_KEY` or `GOOGLE_API_KEY` to run the app.")
     st.stop()
 
 # --- User Inputs (Sidebar) ---
-with st.sidebar:
+# Inputs live in a form so editing them doesn't rerun the script until submit
+with st.sidebar, st.form("trip"):
     st.header("Plan Your Trip")
     destination = st.text_input("Destination (City, Country)", "Hyderabad, India")
-    days = st.number_input("Number of Days", min_value=1, max_value=14, value=3)
-    
-    # Calculate default end date based on days
-    default_end_date = datetime.today() + timedelta(days=days - 1)
-    
+    days = st.number_input("Number of Days", min_value=1, max_value=MAX_DAYS, value=3)
     start_date = st.date_input("Start Date", datetime.today())
-    end_date = st.date_input("End Date", default_end_date)
-    
-    # Update days if the date range is manually adjusted
-    if (end_date - start_date).days + 1 != days:
-        days = (end_date - start_date).days + 1
-        st.info(f"Days updated to **{days}** based on your dates.")
 
     interests = st.multiselect(
         "Interests",
@@ -40,121 +79,255 @@ with st.sidebar:
         default=["Culture", "History"]
     )
     budget = st.number_input("Budget (USD)", min_value=50, step=10, value=200)
+    submitted = st.form_submit_button("🚀 Generate Itinerary", type="primary")
+
+# The trip length is set by Number of Days alone, so the end date always follows from it
+end_date = start_date + timedelta(days=days - 1)
+
+
+def output_token_budget(days):
+    """
+    Scales maxOutputTokens to the number of days in the trip, since decode
+    time grows roughly linearly with output length.
+    """
+    return min(MAX_OUTPUT_TOKENS, BASE_OUTPUT_TOKENS + TOKENS_PER_DAY * days)
+
+
+# --- Response Cache ---
+@st.cache_resource
+def get_response_cache():
+    """
+    Returns the process-wide {inputs: (expires_at, itinerary)} LRU cache shared by all
+    sessions, together with the lock that guards it across session threads.
+    """
+    return OrderedDict(), threading.Lock()
+
+
+def store_in_memory(key, itinerary):
+    """
+    Stores itinerary in the in-memory cache for RESPONSE_TTL seconds, dropping expired
+    entries and then the least recently used ones beyond RESPONSE_CACHE_SIZE.
+    """
+    cache, lock = get_response_cache()
+    now = time.time()
+    with lock:
+        for stale in [k for k, (expires_at, _) in cache.items() if expires_at < now]:
+            del cache[stale]
+        cache[key] = (now + RESPONSE_TTL, itinerary)
+        cache.move_to_end(key)
+        while len(cache) > RESPONSE_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+@st.cache_resource
+def get_disk_cache():
+    """
+    Returns the on-disk cache under the in-memory one, so generated itineraries
+    survive app restarts and redeploys.
+    """
+    import diskcache
+
+    return diskcache.Cache(str(DISK_CACHE_DIR), size_limit=DISK_CACHE_SIZE)
+
+
+def disk_key(key):
+    """
+    Hashes the cache key tuple into a stable string that is identical across processes.
+    """
+    return hashlib.sha256(orjson.dumps(key)).hexdigest()
+
+
+def cached_itinerary(key):
+    """
+    Returns the cached itinerary for key from memory, falling back to disk,
+    or None if missing or expired.
+    """
+    cache, lock = get_response_cache()
+    with lock:
+        entry = cache.get(key)
+        if entry is not None and entry[0] >= time.time():
+            cache.move_to_end(key)
+            return entry[1]
+
+    itinerary = get_disk_cache().get(disk_key(key))
+    if itinerary is not None:
+        # Promote to memory so the next lookup skips the disk read
+        store_in_memory(key, itinerary)
+    return itinerary
+
+
+def remember_itinerary(key, itinerary):
+    """
+    Stores a fully generated itinerary in memory for RESPONSE_TTL seconds
+    and on disk for DISK_CACHE_TTL seconds.
+    """
+    store_in_memory(key, itinerary)
+    get_disk_cache().set(disk_key(key), itinerary, expire=DISK_CACHE_TTL)
 
 
 # --- Generate Itinerary Function (FIXED and Robust) ---
-def generate_itinerary_gemini(destination, days, interests, budget, start_date, end_date, api_key):
+def stream_itinerary(destination, days, interests, budget, start_date, end_date, backend):
     """
-    Calls the Google AI Gemini API with exponential backoff retry logic.
+    Streams the itinerary from the Gemini backend token by token.
     """
-    
-    # The API key is added as a query parameter for authentication
-    url = f"{API_URL}?key={api_key}"
-    
     # --- PROMPT REVISION: Explicitly create day structures ---
-    itinerary_structure = ""
-    for i in range(1, days + 1):
-        itinerary_structure += f"""
-### Day {i}
--   **Morning:** [Fill in low-cost/free activity]
--   **Afternoon:** [Fill in cultural/interest activity]
--   **Evening:** [Fill in cheap food market/local hangout]
--   **Transport Tip:** [Fill in public transport advice]
--   **Estimated Daily Cost:** [Fill in rough daily budget]
-"""
-    
-    prompt = f"""
-You are an expert travel planner creating a detailed, budget-friendly itinerary for students.
+    prompt = _PROMPT_TMPL.format(
+        destination=destination,
+        days=days,
+        interests=", ".join(interests),
+        budget=budget,
+        start_date=start_date,
+        end_date=end_date,
+        structure=_DAY_STRUCTURES[days],
+    )
 
-Destination: {destination}
-Days: {days}
-Interests: {', '.join(interests)}
-Budget: ${budget} (Total estimated cost)
-Travel Dates: {start_date} to {end_date}
+    # Stop as soon as the model starts inventing a day beyond the trip
+    yield from backend.stream(prompt, output_token_budget(days), [f"\n### Day {days + 1}"])
 
-Generate the **{days}-day itinerary** below, strictly filling in the content for each of the pre-defined Day sections.
 
-{itinerary_structure}
+# --- Semantic Cache for Near-Duplicate Requests ---
+@st.cache_resource(show_spinner=False)
+def get_embedder():
+    """
+    Loads the local MiniLM sentence embedder once per process.
+    Returns None when sentence-transformers is not installed or the model can't be
+    loaded (e.g. the first-use download fails), which disables the semantic cache.
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        return None
+    try:
+        return SentenceTransformer("all-MiniLM-L6-v2")
+    except Exception:
+        # A failed model download must not take down the user's generate click
+        return None
+
+
+def normalize_destination(destination):
+    """
+    Lowercases the destination and collapses punctuation, so "Hyderabad, India"
+    and "hyderabad india" compare equal.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", destination.lower()).split())
 
-Conclude the itinerary with a final section titled '💰 Money-Saving Pro Tips' listing 3 actionable, specific budget tips for this destination. Format the entire response using Markdown for clear readability.
-"""
 
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
-    # Corrected Payload Structure: using 'generationConfig' (not 'config')
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {"text": prompt}
-                ]
-            }
-        ],
-        "generationConfig": { 
-            "temperature": 0.7,
-            "maxOutputTokens": 3000 
-        }
-    }
-    
-    # Implement Exponential Backoff Retry Logic
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.post(url, headers=headers, json=payload)
-            
-            # Check for success (200) or permanent client errors (4xx other than 429)
-            if response.status_code == 200:
-                data = response.json()
-                # Correct Response Parsing for generateContent
-                try:
-                    return data["candidates"][0]["content"]["parts"][0]["text"]
-                except (KeyError, IndexError):
-                    return "Error: Could not parse a valid response text from the API."
-            
-            # Check for status codes that suggest retrying (e.g., 429 Rate Limit, 5xx Server Error)
-            elif response.status_code in [429, 500, 503]:
-                # Prepare for retry
-                wait_time = 2 ** attempt
-                if attempt < MAX_RETRIES - 1:
-                    st.warning(f"Rate limit or server error ({response.status_code}). Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                continue
-            
-            else:
-                # Handle permanent errors (e.g., 400 Bad Request, 401 Unauthorized)
-                return f"🚨 API Error: Status Code {response.status_code}\n\n**Response Details:**\n{response.text}"
-
-        except requests.exceptions.RequestException as e:
-            # Handle connection errors
-            wait_time = 2 ** attempt
-            if attempt < MAX_RETRIES - 1:
-                st.warning(f"Connection error: {e}. Retrying in {wait_time}s...")
-                time.sleep(wait_time)
-            continue
-
-    # If all retries fail
-    return f"🚨 API Error: Failed to connect after {MAX_RETRIES} attempts."
-
-# --- Button & Output ---
+def canonicalize(destination, days, interests, budget, start_date, end_date):
+    """
+    Normalizes the inputs so trivial rewordings compare equal.
+    Returns the free-text part to embed and the structured part that must match exactly.
+    """
+    place = normalize_destination(destination)
+    text = f"{place} | interests: {', '.join(sorted(interests))}"
+    # Days, dates and the budget (rounded to $25) shape the itinerary, so they are never fuzzy-matched
+    exact = (days, int(round(budget / 25) * 25), start_date, end_date)
+    return text, exact
+
+
+def semantic_lookup(vec, exact):
+    """
+    Returns the stored itinerary whose inputs are most similar to vec, if above SEMANTIC_THRESHOLD.
+    """
+    candidates = [(v, r) for k, v, r in st.session_state.get("sem_cache", []) if k == exact]
+    if not candidates:
+        return None
+    scores = np.dot(np.stack([v for v, _ in candidates]), vec)
+    best = int(np.argmax(scores))
+    return candidates[best][1] if scores[best] > SEMANTIC_THRESHOLD else None
+
+
+def semantic_store(exact, vec, itinerary):
+    """
+    Remembers itinerary for this session, keeping only the SEMANTIC_CACHE_SIZE most recent entries.
+    """
+    st.session_state.setdefault("sem_cache", deque(maxlen=SEMANTIC_CACHE_SIZE)).append((exact, vec, itinerary))
+
+
+# --- Curated Responses for Popular Short Trips ---
+@st.cache_data(show_spinner=False)
+def load_canned():
+    """
+    Loads the pre-generated itineraries keyed by "destination|Interest,Interest|days".
+    """
+    with open(CANNED_PATH, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def canned_itinerary(destination, days, interests):
+    """
+    Returns the curated itinerary for these inputs, or None if they aren't on the whitelist.
+    """
+    key = f"{normalize_destination(destination)}|{','.join(sorted(interests))}|{days}"
+    return load_canned().get(key)
+
+
+def generate_itinerary_gemini(destination, days, interests, budget, start_date, end_date, backend):
+    """
+    Returns a curated itinerary or one from the semantic or 24h response cache as a string,
+    or a generator that streams a fresh one and caches it once fully assembled.
+    """
+    hit = canned_itinerary(destination, days, interests)
+    if hit is not None:
+        return hit
+
+    # Sorting the interests keeps the cache key independent of selection order
+    key = (destination, days, tuple(sorted(interests)), budget, start_date, end_date)
+    hit = cached_itinerary(key)
+    if hit is not None:
+        return hit
+
+    embedder = get_embedder()
+    if embedder is not None:
+        text, exact = canonicalize(destination, days, interests, budget, start_date, end_date)
+        vec = embedder.encode(text, normalize_embeddings=True)
+        hit = semantic_lookup(vec, exact)
+        if hit is not None:
+            return hit
+
+    def stream_and_cache():
+        parts = []
+        for part in stream_itinerary(destination, days, interests, budget, start_date, end_date, backend):
+            parts.append(part)
+            yield part
+        # Only reached when the stream completed without errors, so errors are never cached
+        result = "".join(parts)
+        remember_itinerary(key, result)
+        if embedder is not None:
+            semantic_store(exact, vec, result)
+
+    return stream_and_cache()
+
+
+# --- Output ---
 st.markdown("---")
-if st.button("🚀 Generate Itinerary", type="primary"):
-    if days <= 0:
-        st.error("Please enter a valid number of days.")
+if submitted:
+    # Validate before any API call, so degenerate inputs never cost a request
+    if not destination.strip():
+        st.error("Please enter a destination.")
+        st.stop()
+    if not interests:
+        st.error("Please pick at least one interest so the itinerary can be tailored to you.")
+        st.stop()
+
+    st.subheader(f"🗺️ Your {days}-Day Student Trip to {destination}")
+    result = generate_itinerary_gemini(
+        destination, 
+        days, 
+        interests, 
+        budget, 
+        start_date, 
+        end_date, 
+        backend
+    )
+    if isinstance(result, str):
+        # Curated and cached itineraries render immediately, without contacting Gemini
+        st.markdown(result)
     else:
         with st.spinner(f"Contacting Gemini AI to plan your {days}-day trip to {destination}..."):
-            result = generate_itinerary_gemini(
-                destination, 
-                days, 
-                interests, 
-                budget, 
-                start_date, 
-                end_date, 
-                gemini_key
-            )
-        
-        st.subheader(f"🗺️ Your {days}-Day Student Trip to {destination}")
-        st.markdown(result)
+            try:
+                st.write_stream(result)
+            except LLMError as e:
+                st.markdown(str(e))
 
 st.markdown("---")
 st.caption("Powered by Google Gemini 2.5 Flash")
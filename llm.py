@@ -0,0 +1,240 @@
+import gzip
+import orjson
+import streamlit as st
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+# Configuration
+MODEL_NAME = "gemini-2.5-flash"
+# v1beta: the stable v1 GenerationConfig rejects thinkingConfig
+API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:streamGenerateContent"
+MAX_RETRIES = 5
+TEMPERATURE = 0.7
+# google-generativeai can't turn thinking off, and thinking tokens count against
+# max_output_tokens, so the SDK backend keeps the original fixed cap instead of
+# the answer-sized budget the REST backend uses
+SDK_MAX_OUTPUT_TOKENS = 3000
+# Off until the endpoint is confirmed to accept "Content-Encoding: gzip" request
+# bodies; if it doesn't, every REST call would fail with 400
+GZIP_REQUEST_BODIES = False
+GZIP_MIN_BYTES = 1024 # Smaller request bodies aren't worth compressing
+
+
+class LLMError(Exception):
+    """
+    Raised for API failures so that error messages are never stored in the response cache.
+    The message is already formatted for display to the user.
+    """
+
+
+def check_finish_reason(finish_reason):
+    """
+    Raises LLMError unless generation ended normally. A MAX_TOKENS, SAFETY or
+    RECITATION stop leaves a truncated itinerary that must not be cached.
+    Hitting a stop sequence also reports STOP.
+    """
+    if finish_reason != "STOP":
+        raise LLMError(
+            f"🚨 Error: Gemini stopped before finishing the itinerary (finish reason: {finish_reason}). Please try again."
+        )
+
+
+# --- Shared Clients (survive Streamlit reruns) ---
+@st.cache_resource
+def get_session():
+    """
+    Returns a pooled requests.Session that survives Streamlit reruns, so the
+    TLS connection to the Gemini API is reused across retries and clicks.
+    Rate limits and server errors are retried with exponential backoff,
+    waiting for the server's Retry-After header when one is sent.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=MAX_RETRIES - 1, # MAX_RETRIES counts attempts, including the first request
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+        allowed_methods=frozenset(["POST"]),
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_model(api_key):
+    """
+    Configures the google-generativeai SDK once per API key and returns the shared model client.
+    The key is part of the cache key, so a rotated key in secrets gets a freshly configured model.
+    """
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(MODEL_NAME)
+
+
+# --- Backends ---
+class LLMBackend:
+    """
+    Turns a prompt into text. Subclasses implement stream(); generate() joins it.
+    Backends must not call any Streamlit elements, so they stay usable outside the UI.
+    """
+
+    def stream(self, prompt, max_output_tokens, stop_sequences=None):
+        """
+        Yields text deltas for prompt as they arrive. Raises LLMError on failure.
+        Decoding halts early at any of stop_sequences.
+        """
+        raise NotImplementedError
+
+    def generate(self, prompt, max_output_tokens, stop_sequences=None):
+        """
+        Returns the full text for prompt. Raises LLMError on failure.
+        """
+        return "".join(self.stream(prompt, max_output_tokens, stop_sequences))
+
+
+class RestGeminiBackend(LLMBackend):
+    """
+    Calls the streamGenerateContent (SSE) REST endpoint over the shared pooled session.
+    """
+
+    def __init__(self, api_key):
+        # The API key is added as a query parameter for authentication
+        self.url = f"{API_URL}?alt=sse&key={api_key}"
+        self.session = get_session()
+
+    def stream(self, prompt, max_output_tokens, stop_sequences=None):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        # Corrected Payload Structure: using 'generationConfig' (not 'config')
+        payload = {
+            "contents": [
+                {
+                    "parts": [
+                        {"text": prompt}
+                    ]
+                }
+            ],
+            "generationConfig": {
+                "temperature": TEMPERATURE,
+                "candidateCount": 1,
+                "maxOutputTokens": max_output_tokens,
+                # Thinking tokens count against maxOutputTokens, which is sized for the answer alone
+                "thinkingConfig": {"thinkingBudget": 0}
+            }
+        }
+        if stop_sequences:
+            payload["generationConfig"]["stopSequences"] = stop_sequences
+
+        body = orjson.dumps(payload)
+        if GZIP_REQUEST_BODIES and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        # Retries and backoff are handled by the session's HTTPAdapter
+        try:
+            response = self.session.post(self.url, headers=headers, data=body, timeout=60, stream=True)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            # Handle permanent errors (e.g., 400 Bad Request, 401 Unauthorized)
+            raise LLMError(
+                f"🚨 API Error: Status Code {e.response.status_code}\n\n**Response Details:**\n{e.response.text}"
+            )
+        except requests.exceptions.RequestException:
+            # Connection errors, or retryable statuses that persisted past MAX_RETRIES
+            raise LLMError(f"🚨 API Error: Failed to connect after {MAX_RETRIES} attempts.")
+
+        received = False
+        finish_reason = None
+        # With stream=True the body is only read here, so network errors can still surface mid-stream
+        try:
+            with response:
+                # Lines are read as bytes: requests would decode text/event-stream as Latin-1
+                for line in response.iter_lines():
+                    if not line.startswith(b"data:"):
+                        continue
+                    chunk = orjson.loads(line[len(b"data:"):])
+                    # Each SSE event carries the next slice of the generateContent response
+                    try:
+                        candidate = chunk["candidates"][0]
+                    except (KeyError, IndexError):
+                        continue
+                    # Only the final event carries a finishReason
+                    finish_reason = candidate.get("finishReason", finish_reason)
+                    try:
+                        text = candidate["content"]["parts"][0]["text"]
+                    except (KeyError, IndexError):
+                        continue
+                    received = True
+                    yield text
+        except requests.exceptions.RequestException as e:
+            # Dropped connections or read timeouts while the response was streaming
+            raise LLMError(f"🚨 API Error: Connection lost while receiving the itinerary: {e}")
+        except orjson.JSONDecodeError:
+            raise LLMError("🚨 Error: Received a malformed response chunk from the API.")
+
+        if not received:
+            raise LLMError("🚨 Error: Could not parse a valid response text from the API.")
+        check_finish_reason(finish_reason)
+
+
+class SdkGeminiBackend(LLMBackend):
+    """
+    Calls Gemini through the google-generativeai SDK.
+    max_output_tokens is not applied here; requests are capped at SDK_MAX_OUTPUT_TOKENS.
+    """
+
+    def __init__(self, api_key):
+        self.model = get_model(api_key)
+
+    def stream(self, prompt, max_output_tokens, stop_sequences=None):
+        from google.api_core import exceptions as google_exceptions
+        from google.generativeai.types import BlockedPromptException, StopCandidateException
+
+        generation_config = {
+            "temperature": TEMPERATURE,
+            "candidate_count": 1,
+            "max_output_tokens": SDK_MAX_OUTPUT_TOKENS,
+        }
+        if stop_sequences:
+            generation_config["stop_sequences"] = stop_sequences
+
+        received = False
+        finish_reason = None
+        try:
+            for chunk in self.model.generate_content(prompt, generation_config=generation_config, stream=True):
+                # FINISH_REASON_UNSPECIFIED (0) until the final chunk
+                if chunk.candidates and chunk.candidates[0].finish_reason:
+                    finish_reason = chunk.candidates[0].finish_reason.name
+                # chunk.text raises ValueError when a chunk carries no text part (e.g. the final one)
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                received = True
+                yield text
+        except google_exceptions.GoogleAPIError as e:
+            raise LLMError(f"🚨 API Error: {e}")
+        except (BlockedPromptException, StopCandidateException) as e:
+            # Raised when the prompt or the generated text is stopped by a safety filter
+            raise LLMError(f"🚨 Error: Gemini blocked this request: {e}")
+
+        if not received:
+            raise LLMError("🚨 Error: Could not parse a valid response text from the API.")
+        check_finish_reason(finish_reason)
+
+
+def get_backend(secrets):
+    """
+    Picks the SDK backend when GOOGLE_API_KEY is configured, otherwise the REST
+    backend with GEMINI_API_KEY. Returns None when neither key is present.
+    """
+    if "GOOGLE_API_KEY" in secrets:
+        return SdkGeminiBackend(secrets["GOOGLE_API_KEY"])
+    if "GEMINI_API_KEY" in secrets:
+        return RestGeminiBackend(secrets["GEMINI_API_KEY"])
+    return None